@@ -5,11 +5,14 @@ from subprocess import run as spawn, DEVNULL
 import io
 import sys
 from tempfile import NamedTemporaryFile
-from contextlib import suppress, nullcontext
+from contextlib import nullcontext
 
 from buildscad import parse
 from build123d import Mesher, Shape
 
+# compiled test scripts, keyed by (path, mtime)
+_code = {}
+
 class Res:
     tolerance = 0.001
     numeric = False
@@ -41,8 +44,10 @@ def testcase(i, may_skip=False):
 
     pyf = Path(f"tests/models/{i :03d}.py")
     if pyf.exists():
-        py = pyf.read_text()
-        pyc = compile(py, str(pyf), "exec")
+        key = (pyf, pyf.stat().st_mtime_ns)
+        pyc = _code.get(key)
+        if pyc is None:
+            pyc = _code[key] = compile(pyf.read_text(), str(pyf), "exec")
         env2 = {}
         env2.update(_env.__dict__)
         exec(pyc, env2, env2)
@@ -50,42 +55,33 @@ def testcase(i, may_skip=False):
             result.add("python",env2["result"]())
             result.numeric = True
         else:
-            with suppress(KeyError):
-                if may_skip and env2["skip"]:
-                    import pytest
-                    pytest.skip("'skip' is set")
-            with suppress(KeyError):
+            if may_skip and env2.get("skip"):
+                import pytest
+                pytest.skip("'skip' is set")
+            if "volume" in env2:
                 result.volume = env2["volume"]
-            with suppress(KeyError):
-                result.trace = env2["tracing"]
-            with suppress(KeyError):
-                result.tolerance = env2["tolerance"]
-            with suppress(KeyError):
-                result.no_add = env2["no_add"]
-            with suppress(KeyError):
-                params = env2["params"]
-            with suppress(KeyError):
-                run = env2["run"]
-            try:
-                res = env2["result"]
-            except KeyError:
-                try:
-                    m2 = env2["work"]
-                except KeyError:
-                    res = None
-                    for v in env2.values():
-                        if not isinstance(v,Shape) or v._dim != 3:
-                            continue
-                        if res is None:
-                            res = v
-                        else:
-                            res += v
-                    assert res, "No Python results. Did you assign them to something?"
-                    m2 = res
-                else:
-                    if m2 is not None:
-                        m2 = m2(**params)
-                result.add("python",m2)
+            result.trace = env2.get("tracing", result.trace)
+            result.tolerance = env2.get("tolerance", result.tolerance)
+            result.no_add = env2.get("no_add", result.no_add)
+            params = env2.get("params", params)
+            run = env2.get("run", run)
+
+            if "work" in env2:
+                m2 = env2["work"]
+                if m2 is not None:
+                    m2 = m2(**params)
+            else:
+                res = None
+                for v in env2.values():
+                    if not isinstance(v,Shape) or v._dim != 3:
+                        continue
+                    if res is None:
+                        res = v
+                    else:
+                        res += v
+                assert res, "No Python results. Did you assign them to something?"
+                m2 = res
+            result.add("python",m2)
 
     scadf = f"tests/models/{i :03d}.scad"
     env1 = parse(scadf)
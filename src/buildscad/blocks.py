@@ -66,6 +66,8 @@ class Module(_Call):
         self.name = name
         self.params = params
         self.body = body
+        # The arguments only exist in the call's DynEnv.
+        body._params = frozenset((*params[0], *params[1]))
 
     """Encapsulates a module declaration"""
     def eval_args(self, env, a, kw):
@@ -100,14 +102,132 @@ class ParentStatement(Statement):
 
 class Variable:
     """Encapsulates a variable assignment"""
+
+    # The value, if it doesn't depend on the caller, and the generation
+    # of the environments it was computed in
+    _value = None
+    _value_gen:int = -1
+
+    _static:bool = False
+    _static_gen:int = -1
+
     def __init__(self, env:StaticEnv, name: str, body: Node):
         self.env = env
         self.name = name
         self.body = body
 
     def eval_with(self, env:DynEnv):
-        return DynEnv(self.env,env).eval(self.body)
+        gen = _Env._var_gen
+        if self._value_gen == gen:
+            return self._value
+        res = DynEnv(self.env,env).eval(self.body)
+        if self.is_static():
+            self._value = res
+            self._value_gen = gen
+        return res
+
+    def is_static(self) -> bool:
+        """
+        Check whether the value is the same wherever it's used, i.e. it
+        doesn't depend on $-variables, module parameters, loop variables
+        and the like.
+        """
+        gen = _Env._var_gen
+        if self._static_gen != gen:
+            self._static = _is_static(self, set())
+            self._static_gen = gen
+        return self._static
+
+
+# Functions whose result may differ between calls with the same
+# arguments, or which have side effects
+_IMPURE = frozenset(("rands", "echo"))
+
+_SYMBOLS = frozenset(("Symbol", "pr_Sym"))
+
+def _symbols(obj, res:set[str]) -> bool:
+    """
+    Collect the names that a static environment, statement or parse tree
+    refers to, into @res.
+
+    Returns False if that can't be determined.
+    """
+    seen = set()
+    todo = [obj]
+    while todo:
+        obj = todo.pop()
+        if id(obj) in seen:
+            continue
+        seen.add(id(obj))
+
+        if isinstance(obj, NonTerminal):
+            todo.extend(obj)
+        elif isinstance(obj, Terminal):
+            if obj.rule_name in _SYMBOLS:
+                res.add(obj.value)
+        elif obj is None or type(obj) is _Const:
+            pass
+        elif isinstance(obj, StaticEnv):
+            todo.extend(obj.work)
+            todo.extend(obj.vars.values())
+            todo.extend(obj.funcs.values())
+            todo.extend(obj.mods.values())
+            # if/else
+            todo.append(getattr(obj, "test", None))
+            todo.append(getattr(obj, "yes", None))
+            todo.append(getattr(obj, "no", None))
+        elif isinstance(obj, ParentStatement):
+            todo.append(obj.body)
+            todo.append(obj.child)
+        elif isinstance(obj, (Statement, Variable, Function, Module)):
+            todo.append(obj.body)
+        else:
+            return False
+    return True
+
+def _is_static(obj:Variable|Function, seen:set[int]) -> bool:
+    if id(obj) in seen:
+        # recursion; the first visit decides
+        return True
+    seen.add(id(obj))
+
+    names = set()
+    if not _symbols(obj.body, names):
+        return False
+    if isinstance(obj, Function):
+        for node in obj.params[1].values():
+            if not _symbols(node, names):
+                return False
+        names.difference_update(obj.params[0], obj.params[1].keys())
+
+    for name in names:
+        if name[0] == "$" or name in _IMPURE:
+            return False
+
+        e = obj.env
+        while name not in e.funcs and name not in e.vars:
+            if name in e._params:
+                # a module parameter
+                return False
+            e = e.parent
+            if not isinstance(e, _Env):
+                # a function parameter, a let() variable, or simply unknown
+                return False
+        d = e.funcs[name] if name in e.funcs else e.vars[name]
+
+        if isinstance(d, (Variable, Function)):
+            if not _is_static(d, seen):
+                return False
+        elif getattr(d, "_env_", False):
+            # built-in
+            pass
+        elif isinstance(e, SpecialEnv):
+            # loop variables and overrides
+            return False
+    return True
 
 # annoying recursive imports
 
-from .env import StaticEnv, DynEnv
+from arpeggio import NonTerminal, Terminal
+from .env import StaticEnv, DynEnv, SpecialEnv, _Env
+from .rules import _Const
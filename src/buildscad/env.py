@@ -1,11 +1,24 @@
 from __future__ import annotations
 
 import sys
+from contextlib import contextmanager
 from contextvars import Token
 import warnings
 
 from . import cur_env, main_env
-from build123d import Shape
+from build123d import Compound, Part, Shape, Sketch, SkipClean
+
+# numeric types, which are never callable
+_NUM = frozenset((int, float))
+
+def _is_num(x) -> bool:
+    """
+    Test for a number, but not a boolean.
+
+    Callers test ``type(x) in _NUM`` inline first, which is faster
+    for plain int and float.
+    """
+    return isinstance(x, (int, float)) and not isinstance(x, bool)
 
 class _working:
     pass
@@ -19,12 +32,87 @@ class _unknown:
 
 ### Environment handling
 
+_mixed: dict[type, type] = {}
+
+def _mix(cls: type, rules: type) -> type:
+    """
+    Combine an environment class with its evaluation rules.
+
+    This happens at runtime because of recursive imports. The result is
+    cached: building a new class per instance is slow, and prevents the
+    interpreter from re-using its attribute caches.
+    """
+    try:
+        return _mixed[cls]
+    except KeyError:
+        pass
+    res = _mixed[cls] = type(cls.__name__+"_", (cls, rules, Evalable), {})
+    return res
+
+@contextmanager
+def use(env:DynEnv):
+    "Temporarily make @env the current environment."
+    token = cur_env.set(env)
+    try:
+        yield env
+    finally:
+        cur_env.reset(token)
+
+# Results of Boolean operations, keyed by the operation and the
+# operands' hashes. A hash depends on the shape's underlying OCCT
+# TShape and its location, not on the Python object: shapes with equal
+# geometry but separate TShapes don't match. The operands are kept so
+# that a hit can be verified. The cache is global, shared by all
+# environments; `clear_cache` empties it.
+_bools: dict[tuple, tuple[list[Shape],Shape]] = {}
+_BOOLS_MAX = 256
+
+# how the tracer spells a cached operation
+_BOOL_TRACE = {"fuse": "_add", "common": "_inter", "cut": "_diff"}
+
+def clear_cache():
+    "Forget all cached Boolean results."
+    _bools.clear()
+
+# Collections of disjoint shapes keep the type that fusing them would
+# produce
+_COMPOUNDS = {2: Sketch, 3: Part}
+
+def _touches(a, b) -> bool:
+    "Test whether two bounding boxes overlap or touch"
+    return (
+        a.min.X <= b.max.X and b.min.X <= a.max.X
+        and a.min.Y <= b.max.Y and b.min.Y <= a.max.Y
+        and a.min.Z <= b.max.Z and b.min.Z <= a.max.Z
+    )
+
+def _separate(objs:list[Shape]) -> tuple[list[Shape],list[Shape]]:
+    """
+    Split a list of shapes into those whose bounding boxes don't touch
+    any other, and the rest.
+    """
+    boxes = [obj.bounding_box() for obj in objs]
+    hit = set()
+    active = []
+    for i in sorted(range(len(objs)), key=lambda i: boxes[i].min.X):
+        bi = boxes[i]
+        active = [j for j in active if boxes[j].max.X >= bi.min.X]
+        for j in active:
+            if _touches(bi, boxes[j]):
+                hit.add(i)
+                hit.add(j)
+        active.append(i)
+
+    loose = [obj for i, obj in enumerate(objs) if i not in hit]
+    rest = [obj for i, obj in enumerate(objs) if i in hit]
+    return loose, rest
+
+
 class NullEnv:
     "An environment that does nothing"
     _level = 0
 
     def var(self, name):
-        breakpoint()
         raise KeyError(name)
     def mod(self, name):
         raise KeyError(name)
@@ -39,6 +127,16 @@ _null = NullEnv()
 
 
 class _Env(NullEnv):
+    # Incremented whenever a name is added to any static environment.
+    # Invalidates the flattened lookup tables.
+    _var_gen:int = 0
+
+    # name => the dict of the environment that has it
+    _flat:dict[str,dict]|None = None
+    _flat_fn:dict[str,dict]|None = None
+    _flat_mod:dict[str,dict]|None = None
+    _flat_gen:int = -1
+
     def __init__(self, parent:StaticEnv|DynEnv|NullEnv = _null):
         assert isinstance(parent,NullEnv), parent
         self.parent = parent
@@ -50,26 +148,60 @@ class _Env(NullEnv):
 
     def var(self, name: str):
         """returns the node that computes a variable"""
-        res = self.vars.get(name, _null)
-        if res is not _null:
-            return res
-        return self.parent.var(name)
+        if self._flat_gen != _Env._var_gen:
+            self._reset_flat()
+
+        vars = self._flat.get(name)
+        if vars is None:
+            env = self
+            while name not in env.vars:
+                env = env.parent
+                if not isinstance(env, _Env):
+                    return env.var(name)
+            self._flat[name] = vars = env.vars
+        return vars[name]
         
+    def _reset_flat(self):
+        self._flat = {}
+        self._flat_fn = {}
+        self._flat_mod = {}
+        self._flat_gen = _Env._var_gen
+
     def func(self, name: str):
-        """returns the node that computes a variable"""
-        res = self.funcs.get(name, None)
-        if res is None:
-            res = self.vars.get(name, None)
-        if res is not None:
-            return res
-        return self.parent.func(name)
-        
+        """returns the node that computes a function"""
+        if self._flat_gen != _Env._var_gen:
+            self._reset_flat()
+
+        d = self._flat_fn.get(name)
+        if d is None:
+            env = self
+            while True:
+                if not isinstance(env, _Env):
+                    return env.func(name)
+                if env.funcs.get(name, None) is not None:
+                    d = env.funcs
+                    break
+                if env.vars.get(name, None) is not None:
+                    d = env.vars
+                    break
+                env = env.parent
+            self._flat_fn[name] = d
+        return d[name]
+
     def mod(self, name: str):
         """returns the node that computes a module"""
-        res = self.mods.get(name, None)
-        if res is not None:
-            return res
-        return self.parent.mod(name)
+        if self._flat_gen != _Env._var_gen:
+            self._reset_flat()
+
+        d = self._flat_mod.get(name)
+        if d is None:
+            env = self
+            while name not in env.mods:
+                env = env.parent
+                if not isinstance(env, _Env):
+                    return env.mod(name)
+            self._flat_mod[name] = d = env.mods
+        return d[name]
 
     def add_var(self, name: str, body: Node, *, _env:StaticEnv|None = None):
         if _env is None:
@@ -78,12 +210,14 @@ class _Env(NullEnv):
             warnings.warn(f"Dup assignment of variable {name !r}")
         else:
             self.vars[name] = Variable(_env , name, body)
+            _Env._var_gen += 1
 
     def add_func_(self, name:str, fn: Callable|Evalable) -> None:
         if name in self.funcs:
             warnings.warn(f"Dup assignment of function {name !r}")
         else:
             self.funcs[name] = fn
+            _Env._var_gen += 1
 
     def add_func(self, name:str, params: Node, body:Node, *, _env:StaticEnv|None =None):
         if _env is None:
@@ -95,6 +229,7 @@ class _Env(NullEnv):
             warnings.warn(f"Dup assignment of module {name !r}")
         else:
             self.mods[name] = mod
+            _Env._var_gen += 1
 
     def add_mod(self, name:str, params: Node, body:Node):
         self.add_mod_(name, Module(name, params, body))
@@ -106,21 +241,21 @@ class _Eval:
 
     def eval(self, node:Node) -> Evalable|None:
         """Create something """
+        rules = self._rules
         while True:
-            try:
-                p = getattr(self, f"_e_{node.rule_name}")
-                if self.debug:
-                    print(" " * self._level, ">", node.rule_name)
-
-            except AttributeError:
-                if not node.rule_name:
-                    raise RuntimeError("trying to interpret a terminal element", node) from None
+            rule = node.rule_name
+            p = rules.get(rule)
+            if p is None:
+                if not rule:
+                    raise RuntimeError("trying to interpret a terminal element", node)
                 print(node.tree_str(), file=sys.stderr)
-                raise RuntimeError(f"Syntax not implemented: {node.rule_name}")
+                raise RuntimeError(f"Syntax not implemented: {rule}")
+            if self.debug:
+                print(" " * self._level, ">", rule)
 
-            else:
+            if rule in self._skip_rules:
                 try:
-                    if len(node) == 1 and hasattr(p, "skip1"):
+                    if len(node) == 1:
                         node = node[0]
                         continue
                 except TypeError:
@@ -129,7 +264,7 @@ class _Eval:
 
         self._level += 1
         try:
-            res = p(node)
+            res = p(self, node)
         except ArityError:
             print(f"ParamCount: {node.rule_name}", file=sys.stderr)
             print(node.tree_str(), file=sys.stderr)
@@ -147,12 +282,11 @@ class StaticEnv(_Eval, _Env):
     """.
     Static environment, collects code blocks.
     """
+    # parameter names, if this is the body of a module
+    _params:frozenset[str] = frozenset()
 
     def __new__(cls, *a, **kw):
-        # Workaround for recursive imports
-        class StaticEnv_(cls, _StaticRules, Evalable):
-            pass
-        return object.__new__(StaticEnv_)
+        return object.__new__(_mix(cls, _StaticRules))
 
     def __init__(self, *a, **kw):
         super().__init__(*a, **kw)
@@ -177,21 +311,25 @@ class SpecialEnv(StaticEnv):
     Static environment, collects code blocks.
     """
     def __new__(cls, *a, **kw):
-        # Workaround for recursive imports
-        class SpecialEnv_(cls, _StaticRules, Evalable):
-            pass
-        return object.__new__(SpecialEnv_)
+        return object.__new__(_mix(cls, _StaticRules))
 
     def set_var(self, name: str, value: Any) -> None:
         """Override a variable"""
+        if name not in self.vars:
+            _Env._var_gen += 1
         self.vars[name] = value
     
     def set_func(self, name: str, value: Callable) -> None:
         """Override a function"""
+        if self.funcs.get(name) is not value:
+            # code that calls it may behave differently now
+            _Env._var_gen += 1
         self.funcs[name] = value
     
     def set_mod(self, name: str, value: Callable) -> None:
         """Override a module"""
+        if self.mods.get(name) is not value:
+            _Env._var_gen += 1
         self.mods[name] = value
     
 
@@ -209,9 +347,7 @@ class DynEnv(_Eval, NullEnv):
     _child_res:Shape|list[Shape|None|_unknown]|Literal[_unknown] = _unknown
 
     def __new__(cls, *a, **kw):
-        class DynEnv_(cls, _DynRules, Evalable):
-            pass
-        return object.__new__(DynEnv_)
+        return object.__new__(_mix(cls, _DynRules))
 
     def __init__(self, static:StaticEnv, dyn: DynEnv|NullEnv = _null, with_vars=False):
         """
@@ -226,6 +362,13 @@ class DynEnv(_Eval, NullEnv):
         # actual values for variables
         self.vars: dict[str,Any] = dyn.vars if with_vars else {}
 
+    def no_cache(self):
+        "Prevent storing the result of the current build on disk."
+        env = self
+        while env.dyn is not _null:
+            env = env.dyn
+        env._cacheable = False
+
     def reset_child(self):
         self._child_env_ = None
         self._child_res = _unknown
@@ -260,7 +403,7 @@ class DynEnv(_Eval, NullEnv):
             return self._child_res
 
         env = self._child_env
-        if len(self._child_res) <= i:
+        if not 0 <= i < len(self._child_res):
             return None
         if (r := self._child_res[i]) is _unknown:
             node = child.work[i]
@@ -269,18 +412,86 @@ class DynEnv(_Eval, NullEnv):
         return r
 
     def child_union(self) -> Shape|None:
-        res = None
-        for r in self.children():
-            if r is None:
-                continue
-            if res is None:
-                res = r
-            else:
-                r2 = res + r
-                self.trace(r2, "_add",res,r)
-                res = r2
+        if self.child is None or isinstance(self.child,Statement):
+            # at most one child, nothing to combine
+            return self.one_child(0)
+        return self.fuse([r for r in self.children() if r is not None])
+
+    def fuse(self, objs:list[Shape]) -> Shape|None:
+        """Union of a list of shapes"""
+        if not objs:
+            return None
+        if len(objs) == 1:
+            return objs[0]
+        return self._cached("fuse", objs, self._fuse)
+
+    def _cached(self, op:str, objs:list[Shape], fn:Callable[[list[Shape]],Shape]) -> Shape:
+        key = (op, *map(hash, objs))
+        hit = _bools.get(key)
+        if hit is not None and all(a.is_same(b) for a, b in zip(hit[0], objs)):
+            res = hit[1]
+            self.trace(res, _BOOL_TRACE[op], *objs)
+            return res
+        res = fn(objs)
+        if len(_bools) >= _BOOLS_MAX:
+            del _bools[next(iter(_bools))]
+        _bools[key] = (objs, res)
         return res
 
+    def _fuse(self, objs:list[Shape]) -> Shape:
+        # Shapes whose bounding boxes don't touch anything else don't
+        # need a Boolean operation; collecting them is sufficient.
+        loose, objs = _separate(objs)
+        if objs:
+            res, *objs = objs
+            # build123d fuses all operands in a single Boolean operation
+            r2 = res + objs
+            self.trace(r2, "_add",res,*objs)
+            loose.insert(0, r2)
+        if len(loose) == 1:
+            return loose[0]
+        res = _COMPOUNDS.get(getattr(loose[0], "_dim", None), Compound)(loose)
+        self.trace(res, "_compound",*loose)
+        return res
+
+    def common(self, objs:list[Shape]) -> Shape|None:
+        """
+        Intersection of a list of shapes.
+
+        The shapes are intersected pairwise, in a balanced tree, so that
+        the operands of each step stay comparable in size. Only the final
+        result is cleaned up.
+        """
+        if len(objs) < 2:
+            return objs[0] if objs else None
+        return self._cached("common", objs, self._common)
+
+    def _common(self, objs:list[Shape]) -> Shape:
+        with SkipClean():
+            while len(objs) > 1:
+                res = []
+                for a, b in zip(objs[0::2], objs[1::2]):
+                    r = a & b
+                    self.trace(r, "_inter",a,b)
+                    res.append(r)
+                if len(objs) % 2:
+                    res.append(objs[-1])
+                objs = res
+        return objs[0].clean()
+
+    def cut(self, res:Shape, objs:list[Shape]) -> Shape:
+        """Remove a list of shapes from another"""
+        if not objs:
+            return res
+        return self._cached("cut", [res, *objs], self._cut)
+
+    def _cut(self, objs:list[Shape]) -> Shape:
+        res, *objs = objs
+        # cut all the tools in a single Boolean operation
+        r = res - objs
+        self.trace(r, "_diff",res,*objs)
+        return r
+
     def children(self) -> Iterator[Shape|None]:
         """Retrieve all children, starting with the first"""
         child = self.child
@@ -311,8 +522,8 @@ class DynEnv(_Eval, NullEnv):
                 return 0
             return len(self.child.work)
 
-        if name in self.vars:
-            val = self.vars[name]
+        val = self.vars.get(name, _unknown)
+        if val is not _unknown:
             if val is _working:
                 raise RuntimeError(f"Recursive variable {name !r}")
             return val
@@ -326,7 +537,11 @@ class DynEnv(_Eval, NullEnv):
             vdef = self.static.var(name)
         self.vars[name] = _working
         try:
-            if hasattr(vdef, "eval_with"):
+            if type(vdef) is Variable:
+                val = vdef.eval_with(self)
+            elif type(vdef) in _NUM:
+                val = vdef
+            elif hasattr(vdef, "eval_with"):
                 val = vdef.eval_with(self)
             elif hasattr(vdef, "_env_"):
                 val = vdef(self)
@@ -358,25 +573,23 @@ class DynEnv(_Eval, NullEnv):
 
         if isinstance(fn, Variable):
             fn = fn.eval_with(self)
+        return self.call(fn, a, kw)
 
-        if hasattr(fn,"eval_args"):
+    def call(self, fn, a, kw):
+        """Call a function or module"""
+        if type(fn) in _BLOCKS:
             return fn.eval_args(self, a, kw)
-        if hasattr(fn, "_env_"):
+        if getattr(fn, "_env_", False):
             return fn(self, *a, **kw)
+        if hasattr(fn,"eval_args"):
+            return fn.eval_args(self, a, kw)
         # "foreign" function
         with self:
             return fn(*a, **kw)
 
     def mod(self, name, *a, **kw):
         """Eval a module"""
-        fn = self.static.mod(name)
-        if hasattr(fn,"eval_args"):
-            return fn.eval_args(self, a, kw)
-        if hasattr(fn, "_env_"):
-            return fn(self, *a, **kw)
-        # "foreign" function
-        with self:
-            return fn(*a, **kw)
+        return self.call(self.static.mod(name), a, kw)
 
     def build_one(self, b):
         if isinstance(b, Shape):
@@ -427,3 +640,7 @@ class DynEnv(_Eval, NullEnv):
 
 from .blocks import Function,Module,Variable,Evalable,Statement
 from .rules import _DynRules, _StaticRules, ArityError
+
+# Dispatch in var() and call() tests these exact types first:
+# a hasattr() that fails is expensive.
+_BLOCKS = frozenset((Function, Module))
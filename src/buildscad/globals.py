@@ -10,13 +10,15 @@ from __future__ import annotations
 import math
 import warnings
 from contextlib import contextmanager
+from functools import lru_cache
 import random
+from itertools import product
 
 from arpeggio import ParseTreeNode as Node
 
-from . import env as env_, Assertion
-from .env import DynEnv
-from .blocks import Function
+from . import env as env_, cur_env, Assertion
+from .env import DynEnv, StaticEnv, _Env, _NUM, _is_num, _touches
+from .blocks import Function, Module, Statement, Variable, _IMPURE, _symbols
 
 from build123d import (
     Align,
@@ -24,6 +26,7 @@ from build123d import (
     Box,
     Circle,
     Compound,
+    Extrinsic,
     Face,
     Plane,
     Polyline,
@@ -34,6 +37,8 @@ from build123d import (
     Solid,
     Sphere,
     Text,
+    Vector,
+    Wire,
     extrude,
     loft,
     make_face,
@@ -46,6 +51,66 @@ from typing import TYPE_CHECKING
 if TYPE_CHECKING:
     VEC = TypeVar("VEC", tuple[float,float] | tuple[float,float,float])
 
+_sin, _cos, _tan, _asin, _acos, _atan, _atan2 = (
+    math.sin, math.cos, math.tan, math.asin, math.acos, math.atan, math.atan2
+)
+_sqrt, _log, _exp, _floor, _ceil, _pow, _hypot = (
+    math.sqrt, math.log, math.exp, math.floor, math.ceil, math.pow, math.hypot
+)
+
+_DEG = math.pi / 180
+_RAD = 180 / math.pi
+
+# sin() of multiples of 90°, which OpenSCAD returns exactly
+_SIN_EXACT = {0: 0.0, 90: 1.0, 180: 0.0, 270: -1.0}
+
+# reseeded by `rands`, so that we don't need a new generator for each call
+_rng = random.Random()
+
+_AXIS_MAP = {(1, 0, 0): Axis.X, (0, 1, 0): Axis.Y, (0, 0, 1): Axis.Z}
+
+# Primitives are cached by their parameters. This is safe because
+# transformations and Boolean operations return new shapes.
+
+@lru_cache(maxsize=1024)
+def _sphere(r):
+    return Sphere(r)
+
+@lru_cache(maxsize=1024)
+def _cube(x, y, z, center):
+    "returns the box and, unless centered, the box moved into place"
+    box = Box(x, y, z)
+    if center:
+        return box, box
+    return box, Pos(x / 2, y / 2, z / 2) * box
+
+@lru_cache(maxsize=1024)
+def _cylinder(h, r1, r2, center):
+    res = Circle(r1)
+    if r1 == r2:
+        res = extrude(res, h)
+    else:
+        res = loft((res, Pos(0, 0, h) * Circle(r2)))
+    if center:
+        res = Pos(0, 0, -h / 2) * res
+    return res
+
+@lru_cache(maxsize=1024)
+def _circle(r):
+    return Circle(r)
+
+@lru_cache(maxsize=1024)
+def _rectangle(x, y, center):
+    return Rectangle(
+        x, y, align=(Align.CENTER, Align.CENTER) if center else (Align.MIN, Align.MIN),
+    )
+
+@lru_cache(maxsize=256)
+def _rot(x, y, z):
+    "rotation about the fixed X, Y and Z axes, in that order"
+    return Rot(x, y, z, ordering=Extrinsic.XYZ)
+
+
 class ForStep:
     def __init__(self, start, end, step=1):
         self.start = start
@@ -53,6 +118,59 @@ class ForStep:
         self.step = step
 
 
+def _for_range(env:DynEnv, stepper:ForStep) -> Iterable[float]:
+    "Resolve an OpenSCAD range to something iterable"
+    start = env.eval(stepper.start)
+    end = env.eval(stepper.end)
+    step = stepper.step if type(stepper.step) in _NUM else env.eval(stepper.step)
+
+    if type(start) is int and type(end) is int and type(step) is int:
+        return range(start, end + (1 if step > 0 else -1), step)
+
+    # the end is inclusive, so allow for rounding errors
+    n = _floor((end - start) / step + 1e-9)
+    return [start + i * step for i in range(n + 1)]
+
+
+def _loop_invariant(body:StaticEnv|Statement, names:list[str]) -> bool:
+    """
+    Check whether the body of a `for` loop yields the same result for
+    every value of the loop variables.
+    """
+    if any(name[0] == "$" for name in names):
+        # dynamically scoped, might be used anywhere
+        return False
+
+    syms = set()
+    if not _symbols(body, syms):
+        return False
+    if not syms.isdisjoint(names) or not syms.isdisjoint(_IMPURE):
+        return False
+
+    # Functions and modules from outside can't see the loop variables,
+    # but they might call something impure.
+    scope = body if isinstance(body, StaticEnv) else body.env
+    done = set()
+    todo = list(syms)
+    while todo:
+        name = todo.pop()
+        if name in done:
+            continue
+        done.add(name)
+        for get in (scope.func, scope.mod):
+            try:
+                fn = get(name)
+            except KeyError:
+                continue
+            if not isinstance(fn, (Function, Module, Variable)):
+                continue
+            more = set()
+            if not _symbols(fn, more) or not more.isdisjoint(_IMPURE):
+                return False
+            todo.extend(more - done)
+    return True
+
+
 class EnvCall:
     """Environment-specific function call."""
 
@@ -60,18 +178,19 @@ class EnvCall:
         self.fn = fn
         self.env = env
         self.is_new = False
+        self.is_dyn = fn[0] == "$"
 
-    def __call__(self, *a, **k):  # noqa:D102  # XXX
-        vars = self.env.vars_dyn if self.fn[0] == "$" else self.env.vars
+    def __call__(self, /, *a, **k):  # noqa:D102  # XXX
+        env = self.env
+        val = (env.vars_dyn if self.is_dyn else env.vars)[self.fn]
+        if not callable(val):
+            raise TypeError(f"Not callable: {val}")
 
-        token = env_.set(self.env)
-        try:
-            val = vars[self.fn]
-            if not callable(val):
-                raise TypeError(f"Not callable: {val}")
+        # calls from within the same environment are common
+        if cur_env.get(None) is env:
+            return val(*a, **k)
+        with env_.use(env):
             return val(*a, **k)
-        finally:
-            env_.reset(token)
 
 
 class EnvEval:
@@ -80,13 +199,10 @@ class EnvEval:
     def __init__(self, node):
         self.node = node
 
-    def __call__(self, /, env):
+    def __call__(self, env, /):
         from .eval import Eval
-        token = env_.set(env)
-        try:
+        with env_.use(env):
             return Eval(env).eval(self.node)
-        finally:
-            env_.reset(token)
 
 
 class _Fns(DynEnv):
@@ -94,13 +210,9 @@ class _Fns(DynEnv):
         return "0.1.0"
 
     def echo(self, *a, **k):  # noqa:D102
-        class DE:
-            def __repr__(self):
-                return ", ".join(f"{k} = {v !r}" for k, v in k.items())
-
-        if k:
-            a = a + (DE(),)
-        print("ECHO:", ", ".join(repr(x) for x in a))
+        res = [repr(x) for x in a]
+        res.extend(f"{n} = {v !r}" for n, v in k.items())
+        print("ECHO:", ", ".join(res))
 
     def assert_(self, chk, msg=None):
         if chk:
@@ -129,9 +241,11 @@ class _Fns(DynEnv):
 
     def rands(self, min: float, max:float, n:int, seed=None) -> float:
         if seed is None:
+            self.no_cache()
             r = random.random
         else:
-            r=random.Random(seed=seed).random
+            _rng.seed(seed)
+            r = _rng.random
 
         rd = max-min
         return [ r()*rd+min for _ in range(n)]
@@ -154,11 +268,11 @@ class _Fns(DynEnv):
     def sign(self, x: float) -> int:
         return 0 if x == 0 else 1 if x>0 else -1
 
-    def norm(self, *x: float) -> float:
-        return math.sqrt(sum(v*v for v in x))
+    def norm(self, x: VEC) -> float:
+        return _hypot(*x)
 
     def pow(self, x: float, y: float) -> float:
-        return math.pow(x,y)
+        return _pow(x,y)
 
     def min(self, *x: float) -> float:
         return min(*x)
@@ -167,7 +281,7 @@ class _Fns(DynEnv):
         return max(*x)
 
     def floor(self, x: float) -> float:
-        return math.floor(x)
+        return _floor(x)
 
     def round(self, x: float) -> float:
         return round(x, 0)
@@ -176,37 +290,43 @@ class _Fns(DynEnv):
         return len(x)
 
     def ceil(self, x: float) -> float:
-        return math.ceil(x)
+        return _ceil(x)
 
     def log(self, x: float) -> float:
-        return math.log(x)
+        return _log(x)
 
     def exp(self, x: float) -> float:
-        return math.exp(x)
+        return _exp(x)
 
     def sqrt(self, x: float) -> float:
-        return math.sqrt(x)
+        return _sqrt(x)
 
     def sin(self, x: float) -> float:
-        return math.sin(x * math.pi / 180)
+        if (r := _SIN_EXACT.get(x % 360)) is not None:
+            return r
+        return _sin(x * _DEG)
 
     def cos(self, x: float) -> float:
-        return math.cos(x * math.pi / 180)
+        if (r := _SIN_EXACT.get((x + 90) % 360)) is not None:
+            return r
+        return _cos(x * _DEG)
 
     def tan(self, x: float) -> float:
-        return math.tan(x * math.pi / 180)
+        if x % 180 == 0:
+            return 0.0
+        return _tan(x * _DEG)
 
     def asin(self, x: float) -> float:
-        return math.asin(x) * 180 / math.pi
+        return _asin(x) * _RAD
 
     def acos(self, x: float) -> float:
-        return math.acos(x) * 180 / math.pi
+        return _acos(x) * _RAD
 
     def atan(self, x: float) -> float:
-        return math.atan(x) * 180 / math.pi
+        return _atan(x) * _RAD
 
     def atan2(self, x: float, y: float) -> float:
-        return math.atan2(x, y) * 180 / math.pi
+        return _atan2(x, y) * _RAD
 
     def is_undef(self, x:Any) -> bool:
         return x is None
@@ -215,7 +335,7 @@ class _Fns(DynEnv):
         return isinstance(x, bool)
 
     def is_num(self, x:Any) -> bool:
-        return isinstance(x (int,float))
+        return type(x) in _NUM or _is_num(x)
 
     def is_string(self, x:Any) -> bool:
         return isinstance(x, str)
@@ -236,21 +356,19 @@ class _Mods(DynEnv):
         elif d is not None:
             warnings.warn("sphere: parameters are ambiguous")
 
-        res = Sphere(r)
+        res = _sphere(r)
         self.trace(res,"Sphere",r)
         return res
 
     def cube(self, size=1, center=False):  # noqa:D102
-        if isinstance(size, (int, float)):
+        if type(size) in _NUM or _is_num(size):
             x, y, z = size, size, size
         else:
             x, y, z = size
-        res = Box(x, y, z)
-        self.trace(res,"Box",x,y,z)
-        if not center:
-            res2 = Pos(x / 2, y / 2, z / 2) * res
-            self.trace(res2,"Pos", x / 2, y / 2, z / 2, _mul=res)
-            res = res2
+        box, res = _cube(x, y, z, bool(center))
+        self.trace(box,"Box",x,y,z)
+        if res is not box:
+            self.trace(res,"Pos", x / 2, y / 2, z / 2, _mul=box)
         return res
 
     def for_(self, _intersect=False, **vars_):
@@ -258,46 +376,56 @@ class _Mods(DynEnv):
             raise ValueError("'for' called without variables")
 
         ch = self.child
-        res = None
+        res = []
         xenv = DynEnv(ch, self)
         venv = ch.parent
 
-        def _for(**vs):
-            nonlocal res
-
-            if vs:
-                var, stepper = vs.popitem()
-                if not isinstance(stepper,(list,tuple)):
-                    stp=stepper.step if isinstance(stepper.step, (int, float)) else self.eval(node=stepper.step)
-                    stepper = range(
-                        self.eval(node=stepper.start),
-                        self.eval(node=stepper.end)+stp,
-                    )
-                for val in stepper:
+        names = []
+        steppers = []
+        for var, stepper in vars_.items():
+            if type(stepper) is ForStep:
+                stepper = _for_range(self, stepper)
+            elif not isinstance(stepper, (list, tuple, range, str)):
+                # a single value
+                stepper = (stepper,)
+            names.append(var)
+            steppers.append(stepper)
+
+        # Overrides can rebind what the body calls; they bump the generation.
+        key = (tuple(names), _Env._var_gen)
+        if getattr(ch, "_for_inv", (None,))[0] != key:
+            ch._for_inv = (key, _loop_invariant(ch, names))
+        if ch._for_inv[1]:
+            # The union, or intersection, of identical shapes is the
+            # shape itself: build it once.
+            for vals in product(*steppers):
+                for var, val in zip(names, vals):
                     venv.set_var(var, val)
-                    _for(**vs)
-            else:
-                r = xenv.build_one(ch)
-                if r is None:
-                    return
-                elif res is None:
-                    res = r
-                elif _intersect:
-                    r2 = res & r
-                    self.trace(r2, "_inter",res,r)
-                    res = r2
-                else:
-                    r2 = res + r
-                    self.trace(r2, "_add",res,r)
-                    res = r2
-
-        _for(**vars_)
-        return res
+                return xenv.build_one(ch)
+            return None
+
+        for vals in product(*steppers):
+            for var, val in zip(names, vals):
+                venv.set_var(var, val)
+
+            r = xenv.build_one(ch)
+            if r is not None:
+                res.append(r)
+
+        if _intersect:
+            return self.common(res)
+        return self.fuse(res)
 
     def intersection_for_(self, **var):
         return self.for_(_intersect=True, **var)
 
     def cylinder(self, h=1, r1=None, r2=None, r=None, d=None, d1=None, d2=None, center=False):  # noqa:D102
+        if r1 is None and r2 is None and d1 is None and d2 is None and (r is None or d is None):
+            # common case: straight cylinder, unambiguous
+            if r is None:
+                r = 1 if d is None else d / 2
+            return _cylinder(h, r, r, bool(center))
+
         if (
             (
                 (r1 is not None)
@@ -320,21 +448,14 @@ class _Mods(DynEnv):
         if d1 is not None:
             r1 = d1 / 2
         if d2 is not None:
-            r2 = d1 / 2
+            r2 = d2 / 2
 
         if r1 is None:
             r1 = 1
         if r2 is None:
             r2 = r1
 
-        res = Circle(r1)
-        if r1 == r2:
-            res = extrude(res, h)
-        else:
-            res = loft((res, Pos(0, 0, h) * Circle(r2)))
-        if center:
-            res = Pos(0, 0, -h / 2) * res
-        return res
+        return _cylinder(h, r1, r2, bool(center))
 
     def translate(self, v) -> Shape:  # noqa:D102
         ch = self.child_union()
@@ -349,17 +470,32 @@ class _Mods(DynEnv):
         ch = self.child_union()
         if ch is None:
             return None
-        if v is not None and v != [0, 0, 0]:
-            axis = Axis((0,0,0),tuple(v))
+        if not a:
+            # no angle, or zero: nothing to do
+            return ch
+
+        if v is not None and any(v):
+            v = tuple(v)
+            axis = _AXIS_MAP.get(v)
+            if axis is None:
+                axis = Axis((0,0,0),v)
             res = ch.rotate(axis, a)
             self.trace(res,"rotate", axis, a, _obj=ch)
             return res
 
-        elif isinstance(a, (float, int)):
+        elif type(a) in _NUM or _is_num(a):
             res = ch.rotate(Axis.Z, a)
             self.trace(res,"rotate", Axis.Z, a, _obj=ch)
             return res
 
+        x, y, z = a
+        if (x != 0) + (y != 0) + (z != 0) > 1:
+            # OpenSCAD rotates about the fixed X, Y and Z axes, in that
+            # order. Do that in a single transformation.
+            res = _rot(x, y, z) * ch
+            self.trace(res,"Rot", x, y, z, ordering=Extrinsic.XYZ, _mul=ch)
+            return res
+
         if a[0]:
             ch2 = ch.rotate(Axis.X, a[0])
             self.trace(ch2,"rotate", Axis.X, a[0], _obj=ch)
@@ -377,30 +513,20 @@ class _Mods(DynEnv):
     def difference(self) -> Shape|None:  # noqa:D102
         ch = iter(self.children())
         res = next(ch)
-        if res is not None:
-            for obj in ch:
-                if obj is None:
-                    continue
-                r = res-obj
-                self.trace(r, "_diff",res,obj)
-                res = r
-        return res
+        if res is None:
+            return None
+        # tools that can't touch the object don't need to be cut
+        bb = res.bounding_box()
+        objs = [obj for obj in ch if obj is not None and _touches(bb, obj.bounding_box())]
+        return self.cut(res, objs)
 
     def union(self) -> Shape:  # noqa:D102
         return self.child_union()
 
     def intersection(self) -> Shape:  # noqa:D102
-        res = None
-        for obj in self.children():
-            if obj is None:
-                continue
-            if res is None:
-                res = obj
-            else:
-                r = res & obj
-                self.trace(r, "_inter",res,obj)
-                res = r
-        return res.clean()
+        # Not batched: with more than one tool, OCCT intersects the
+        # object with the union of the tools.
+        return self.common([obj for obj in self.children() if obj is not None])
 
     def resolve(self, idx=None) -> Shape:
         _ch = self.work
@@ -425,25 +551,42 @@ class _Mods(DynEnv):
         return res[idx]
 
     def children(self, idx=None) -> Shape:  # noqa:D102
-        return self.one_child(idx)
+        if idx is None:
+            return self.child_union()
+        if type(idx) in _NUM or _is_num(idx):
+            return self.one_child(int(idx))
+        if type(idx) is ForStep:
+            idx = _for_range(self, idx)
+        # several children: a single union
+        return self.fuse([r for i in idx if (r := self.one_child(int(i))) is not None])
 
     def import_(self, name) -> Shape:
+        # the file's contents aren't part of the cache key
+        self.no_cache()
         fn = self["_path"].parent / name
+        import numpy as np
         from stl.mesh import Mesh
 
         vectors = Mesh.from_file(fn).vectors
-        points = tuple(map(tuple, vectors.reshape((vectors.shape[0] * vectors.shape[1], 3))))
-        faces = [(i, i + 1, i + 2) for i in range(0, len(points), 3)]
+        # STL repeats each vertex for every triangle it's part of
+        points, faces = np.unique(vectors.reshape(-1, 3), axis=0, return_inverse=True)
+        faces = faces.reshape(-1, 3)
+        # drop degenerate triangles
+        faces = faces[(faces[:, 0] != faces[:, 1]) & (faces[:, 1] != faces[:, 2]) & (faces[:, 0] != faces[:, 2])]
+        points = points.tolist()
+        faces = faces.tolist()
         return self.polyhedron(points, faces)
 
     def polyhedron(self, points, faces, convexity=None) -> Shape:
 
-        points = [tuple(x) for x in points]
-
-        def PL(path):
-            return Polyline(*((points[x]) for x in path), close=True)
+        # convert each point once, not once per face that uses it
+        points = [Vector(*x) for x in points]
 
-        return Solid.make_solid(Shell.make_shell(Face.make_from_wires(PL(face)) for face in faces))
+        # Wire.make_polygon skips the BuildLine context handling of Polyline
+        return Solid.make_solid(Shell.make_shell(
+            Face.make_from_wires(Wire.make_polygon([points[x] for x in face], close=True))
+            for face in faces
+        ))
 
     def polygon(self, points, paths=None) -> Sketch:
         if paths is None:
@@ -488,7 +631,7 @@ class _Mods(DynEnv):
         return res
 
     def scale(self, v) -> Shape:
-        if isinstance(v, (float, int)):
+        if type(v) in _NUM or _is_num(v):
             x, y, z = v, v, v
         else:
             x, y, z = v
@@ -514,14 +657,12 @@ class _Mods(DynEnv):
         return self.child_union()
 
     def square(self, size=1, center=False) -> Shape:
-        if isinstance(size, (int, float)):
+        if type(size) in _NUM or _is_num(size):
             x, y = size, size
         else:
             x, y = size
 
-        return Rectangle(
-            x, y, align=(Align.CENTER, Align.CENTER) if center else (Align.MIN, Align.MIN),
-        )
+        return _rectangle(x, y, bool(center))
 
     def circle(self, r=None, d=None) -> Shape:
         if r is None:
@@ -532,7 +673,7 @@ class _Mods(DynEnv):
         elif d is not None:
             warnings.warn("circle: parameters are ambiguous")
 
-        return Circle(r)
+        return _circle(r)
 
     def text(
         self,
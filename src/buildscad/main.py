@@ -3,18 +3,49 @@ Main wrapper to process OpenSCAD files
 """
 from __future__ import annotations
 
+import hashlib
+import math
+import os
 import sys
+from importlib.metadata import version, PackageNotFoundError
 from io import IOBase
 from pathlib import Path
 from contextlib import contextmanager, nullcontext
+from enum import Enum
 from itertools import chain
 
-from .peg import Parser
-from .env import StaticEnv,DynEnv,SpecialEnv
+from .peg import Parser, cache_dir
+from .env import StaticEnv,DynEnv,SpecialEnv,_Env,clear_cache
 from .globals import _Fns,_Mods
+from .rules import constfold, flatten
 from . import main_env
 
-from build123d import Shape, Axis
+from build123d import Axis, Compound, Part, Shape, Sketch, export_brep, import_brep
+
+# Parse trees of files, keyed by (path, mtime)
+_trees: dict[tuple[Path,int],Node] = {}
+_TREES_MAX = 64
+
+# Result types that are rebuilt when loading a cached model
+_CACHED_TYPES = {"Part": Part, "Sketch": Sketch}
+
+
+def _version(pkg: str) -> str|None:
+    try:
+        return version(pkg)
+    except PackageNotFoundError:
+        return None
+
+
+def _load_brep(fn: Path, cls: type|None) -> Shape:
+    "Load a cached model, as the type it was built as"
+    res = import_brep(str(fn))
+    if cls is None or isinstance(res, cls):
+        return res
+    if isinstance(res, Compound):
+        return cls(res.wrapped)
+    return cls([res])
+
 
 class _MainEnv(SpecialEnv):
     "main environment with global variables"
@@ -42,11 +73,17 @@ class _MainEnv(SpecialEnv):
                 d[k] = v
         collect(_Mods, env.mods)
         collect(_Fns, env.funcs)
+        env.vars["PI"] = math.pi
 
     def add_var(self, *a, **kw):
         "internal. Forwards to parent."
         self.parent.add_var(*a, _env=self, **kw)
 
+    def set_var(self, name: str, value: Any) -> None:
+        super().set_var(name, value)
+        # drop values that might depend on the old one
+        _Env._var_gen += 1
+
     def add_func(self, *a, **kw):
         super().add_func(*a, _env=self, **kw)
 
@@ -76,6 +113,18 @@ class Env(DynEnv):
         self.vars["$trace"] = False
         self._tcache = {}
         self._tnext = 1
+        self._source = None
+        self._overrides = {}
+        self._cacheable = True
+
+    def clear_cache(self):
+        """
+        Forget cached Boolean results.
+
+        The cache is shared by all environments, so this affects every
+        `Env`, not just this one.
+        """
+        clear_cache()
 
     def add_var(self, name, value:int|float|str):
         """
@@ -87,6 +136,7 @@ class Env(DynEnv):
             raise RuntimeError("Use 'set_var' for dynamic variables")
         else:
             self.static.add_var(name, value)
+        self._overrides[name] = value
 
     def add_func(self, name: str, value: Callable):
         """
@@ -95,6 +145,7 @@ class Env(DynEnv):
         Warns if the function already exists.
         """
         self.static.add_func_(name, value)
+        self._overrides[name] = value
 
     def add_mod(self, name: str, value: int|float|str):
         """
@@ -103,6 +154,7 @@ class Env(DynEnv):
         Warns if the module already exists.
         """
         self.static.add_mod_(name, value)
+        self._overrides[name] = value
 
     def set_var(self, name: str, value: int|float|str):
         """
@@ -114,7 +166,8 @@ class Env(DynEnv):
         if name[0] == "$":
             self.vars[name] = value
         else:
-            self.static.vars[name] = value
+            self.static.set_var(name, value)
+        self._overrides[name] = value
 
     def set_func(self, name, value: Callable):
         """
@@ -123,7 +176,8 @@ class Env(DynEnv):
         This method doesn't complain if the function already exists.
         You should use `add_func` instead, if possible.
         """
-        self.static.funcs[name] = value
+        self.static.set_func(name, value)
+        self._overrides[name] = value
 
     def set_mod(self, name, value: Callable):
         """
@@ -132,13 +186,81 @@ class Env(DynEnv):
         This method doesn't complain if the module already exists.
         You should use `add_mod` instead, if possible.
         """
-        self.static._mods[name] = value
+        self.static.set_mod(name, value)
+        self._overrides[name] = value
 
     def parse(self, data:str):
         p = Parser(debug=False, reduce_tree=False)
-        node = p.parse(data)
+        node = constfold(flatten(p.parse(data)))
+        self.static.eval(node)
+
+    def parse_file(self, fn:Path):
+        """
+        Parse a file.
+
+        The parse tree is re-used until the file is modified.
+        """
+        fn = fn.resolve()
+        key = (fn, fn.stat().st_mtime_ns)
+        node = _trees.get(key)
+        if node is None:
+            p = Parser(debug=False, reduce_tree=False)
+            node = constfold(flatten(p.parse(fn.read_text())))
+            if len(_trees) >= _TREES_MAX:
+                del _trees[next(iter(_trees))]
+            _trees[key] = node
         self.static.eval(node)
 
+    def _build_file(self) -> Path|None:
+        """
+        The on-disk cache file for building this model, without the
+        suffix that records the result type, or `None` if the result
+        can't be cached.
+        """
+        if self._source is None or (base := cache_dir()) is None:
+            return None
+        if any(callable(v) for v in self._overrides.values()):
+            return None
+        key = (
+            _version("buildscad"), _version("build123d"), self._source,
+            sorted(self._overrides.items()),
+            sorted((k, v) for k, v in self.vars.items() if k[0] == "$" and k != "$trace"),
+        )
+        h = hashlib.blake2b(repr(key).encode("utf-8"), digest_size=16)
+        return base / f"build-{h.hexdigest()}"
+
+    def build(self):
+        """
+        Build the model.
+
+        If `process` was called with ``cache=True``, the result is stored
+        on disk and re-used by later runs on the same sources. Tracing
+        bypasses the cache.
+        """
+        stem = None if self.vars["$trace"] else self._build_file()
+        if stem is None:
+            return super().build()
+        for tname in (*_CACHED_TYPES, "Shape"):
+            fn = stem.with_name(f"{stem.name}.{tname}.brep")
+            if fn.exists():
+                return _load_brep(fn, _CACHED_TYPES.get(tname))
+
+        res = super().build()
+        if res is not None and self._cacheable:
+            tname = next((k for k, cls in _CACHED_TYPES.items() if isinstance(res, cls)), "Shape")
+            fn = stem.with_name(f"{stem.name}.{tname}.brep")
+            tmp = fn.with_suffix(f".{os.getpid()}.tmp")
+            try:
+                fn.parent.mkdir(parents=True, exist_ok=True)
+                if export_brep(res, str(tmp)):
+                    tmp.replace(fn)
+            except Exception:
+                # not being able to cache is not an error
+                pass
+            finally:
+                tmp.unlink(missing_ok=True)
+        return res
+
     def run(self):
         return self.union(self.static.work)
 
@@ -171,6 +293,9 @@ class Env(DynEnv):
                     print(f"o_{tn} = Axis{obj !r}")
                 return f"o_{tn}"
 
+            if isinstance(obj,Enum):
+                return f"{type(obj).__name__}.{obj.name}"
+
             if isinstance(obj,Shape):
                 oid = id(obj)
                 if (tn := self._tcache.get(oid, None)) is None:
@@ -190,7 +315,10 @@ class Env(DynEnv):
             print(f"{rs}{' & '.join(vn(x) for x in a)}")
             return
         if op == "_diff":
-            print(f"{rs}{' & '.join(vn(x) for x in a)}")
+            print(f"{rs}{' - '.join(vn(x) for x in a)}")
+            return
+        if op == "_compound":
+            print(f"{rs}{type(res).__name__}([{', '.join(vn(x) for x in a)}])")
             return
         obj = kw.pop("_obj", None)
         if obj is not None:
@@ -212,21 +340,20 @@ def parse(f: Path | str, /) -> MainEnv:
     Additional keyword arguments are used as variables variables.
     A warning is printed if there's a conflict.
     """
+    env = Env()
     if isinstance(f, IOBase):
         r = f.read()
         f.close()
+        env.parse(r)
     elif isinstance(f, str) and "\n" in f:
-        r = f
+        env.parse(f)
     else:
-        r = Path(f).read_text()
-
-    env = Env()
-    env.parse(r)
+        env.parse_file(Path(f))
 
     return env
 
 
-def process(f, /, preload=(), **kw) -> Env:
+def process(f, /, preload=(), cache=False, **kw) -> Env:
     """process an OpenSCAD file.
 
     Returns a build123d object with the result.
@@ -239,8 +366,16 @@ def process(f, /, preload=(), **kw) -> Env:
     modules.
 
     Call the `build` method on the result to get (a composite of) the top-level object.
+
+    If @cache is set, `build` stores its result on disk, keyed by the
+    contents of the file and the overrides in effect when it's called,
+    and later runs load it instead of re-building the model. Models that
+    import other files or call ``rands`` without a seed are not cached,
+    nor are preloads or overrides with functions or modules.
     """
     env = parse(f)
+    if cache and not preload and not isinstance(f, IOBase) and not (isinstance(f, str) and "\n" in f):
+        env._source = hashlib.blake2b(Path(f).read_bytes(), digest_size=16).hexdigest()
     for fn in preload:
         with open(fn) as fd:
             fc = fd.read()
@@ -13,13 +13,20 @@ grammar specification for OpenSCAD's syntax.
 #######################################################################
 from __future__ import annotations
 
+import hashlib
+import os
+import pickle
+from contextlib import suppress
+from functools import lru_cache
 from pathlib import Path
 
+import arpeggio
 from arpeggio import (
     EOF,
     Not,
     OneOrMore,
     Optional,
+    ParsingExpression,
     ParserPython,
     ZeroOrMore,
     visit_parse_tree,
@@ -96,6 +103,77 @@ def comment():
     return _("//[^\n]*", multiline=False)
 
 
+@lru_cache(maxsize=None)
+def _grammar() -> str:
+    "The OpenSCAD grammar. Read only once."
+    return (Path(__file__).parent / "openscad.peg").read_text()
+
+
+# The grammar doesn't change, so its parser model is built only once
+# and shared by all `Parser` instances.
+_models: dict[tuple, tuple] = {}
+
+
+def cache_dir() -> Path|None:
+    """
+    The directory for buildscad's on-disk caches.
+
+    ``$BUILDSCAD_CACHE`` overrides the default, ``$XDG_CACHE_HOME/buildscad``
+    or ``~/.cache/buildscad``. If it's empty, there is no on-disk cache:
+    this function returns `None`.
+    """
+    base = os.environ.get("BUILDSCAD_CACHE")
+    if base is not None:
+        return Path(base) if base else None
+    base = os.environ.get("XDG_CACHE_HOME")
+    base = Path(base) if base else Path.home() / ".cache"
+    return base / "buildscad"
+
+
+def _model_file(key: tuple) -> Path|None:
+    base = cache_dir()
+    if base is None:
+        return None
+    version = getattr(arpeggio, "__version__", None)
+    h = hashlib.blake2b(repr((version,) + key).encode("utf-8"), digest_size=16)
+    return base / f"peg-{h.hexdigest()}.pkl"
+
+
+def _load_model(key: tuple) -> tuple|None:
+    "Load a pickled parser model, if there is a usable one."
+    fn = _model_file(key)
+    if fn is None:
+        return None
+    try:
+        with fn.open("rb") as f:
+            res = pickle.load(f)
+    except FileNotFoundError:
+        return None
+    except Exception:
+        res = None
+    if isinstance(res, (tuple, list)) and len(res) == 2 and isinstance(res[0], ParsingExpression):
+        return res
+    # unreadable or corrupt: discard it
+    with suppress(OSError):
+        fn.unlink()
+    return None
+
+
+def _save_model(key: tuple, model: tuple) -> None:
+    "Pickle a parser model for the next run. Failure is not an error."
+    fn = _model_file(key)
+    if fn is None:
+        return
+    tmp = fn.with_suffix(f".{os.getpid()}.tmp")
+    try:
+        fn.parent.mkdir(parents=True, exist_ok=True)
+        with tmp.open("wb") as f:
+            pickle.dump(model, f, protocol=pickle.HIGHEST_PROTOCOL)
+        tmp.replace(fn)
+    except Exception:
+        tmp.unlink(missing_ok=True)
+
+
 class Parser(ParserPEGOrig):
     "Parser for OpenSCAD grammar"
 
@@ -109,18 +187,25 @@ class Parser(ParserPEGOrig):
             root_rule_name(str): The name of the root rule.
             comment_rule_name(str): The name of the rule for comments.
         """
-        language_def = (Path(__file__).parent / "openscad.peg").read_text()
+        language_def = _grammar()
         self.__debug = debug
         super().__init__(language_def, "Input", "Comment", *args, **kwargs)
 
     def _from_peg(self, language_def):
-        parser = ParserPython(peggrammar, comment, reduce_tree=False, debug=False)
-        parser.root_rule_name = self.root_rule_name
-        parse_tree = parser.parse(language_def)
-
-        res = visit_parse_tree(
-            parse_tree,
-            PEGVisitor(self.root_rule_name, self.comment_rule_name, self.ignore_case),
-        )
+        key = (language_def, self.root_rule_name, self.comment_rule_name, self.ignore_case)
+        res = _models.get(key)
+        if res is None:
+            res = _load_model(key)
+        if res is None:
+            parser = ParserPython(peggrammar, comment, reduce_tree=False, debug=False)
+            parser.root_rule_name = self.root_rule_name
+            parse_tree = parser.parse(language_def)
+
+            res = visit_parse_tree(
+                parse_tree,
+                PEGVisitor(self.root_rule_name, self.comment_rule_name, self.ignore_case),
+            )
+            _save_model(key, res)
+        _models[key] = res
         self.debug = self.__debug
         return res
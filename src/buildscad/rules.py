@@ -3,19 +3,22 @@ Rules for parsing OpenSCAD.
 """
 from __future__ import annotations
 
+import ast
 import logging
 import math
+import operator
 import sys
 import warnings
-from functools import partial
+from functools import lru_cache
+from operator import itemgetter
 from pathlib import Path
+from typing import Any
 
 from . import env
 from .peg import Parser
 
-from arpeggio import ParseTreeNode as Node
+from arpeggio import NonTerminal, ParseTreeNode as Node
 from build123d.topology import Compound
-from simpleeval import simple_eval
 
 logger = logging.getLogger(__name__)
 
@@ -27,7 +30,12 @@ class ArityError(ValueError):
 
 
 def arity(n, a, b=None):
-    "Checker for parse tree processors"
+    """
+    Checker for parse tree processors.
+
+    The grammar already fixes these counts, so evaluation-time callers
+    guard this with ``if __debug__:``, which ``python -O`` removes.
+    """
     if b is None:
         if len(n) != a:
             raise ArityError(n, a)
@@ -35,6 +43,73 @@ def arity(n, a, b=None):
         raise ArityError(n, a, b)
 
 
+@lru_cache(maxsize=None)
+def _num_literal(val:str) -> int|float:
+    "Decode a numeric literal. Cached, as the same literals recur a lot."
+    return int(val) if val.isdigit() else float(val)
+
+
+@lru_cache(maxsize=None)
+def _str_literal(val:str) -> str:
+    "Decode a string literal. Its quoting and escapes are Python's."
+    return ast.literal_eval(val)
+
+
+_pow = math.pow
+
+_VEC = frozenset((list, tuple))
+
+def _elementwise(op):
+    "Vector +/-: element by element, recursively; scalars as usual"
+    def fn(a, b):
+        if type(a) in _VEC and type(b) in _VEC:
+            return list(map(fn, a, b))
+        return op(a, b)
+    return fn
+
+def _dot(a, b):
+    return sum(map(operator.mul, a, b))
+
+def _matmul(a, b):
+    "Vector/matrix products, as OpenSCAD's ``*`` does them"
+    ma = bool(a) and type(a[0]) in _VEC
+    mb = bool(b) and type(b[0]) in _VEC
+    if mb:
+        cols = list(zip(*b))
+        if ma:
+            return [[_dot(row, col) for col in cols] for row in a]
+        return [_dot(a, col) for col in cols]
+    if ma:
+        return [_dot(row, b) for row in a]
+    return _dot(a, b)
+
+def _neg(a):
+    "Unary minus, recursively for vectors"
+    if type(a) in _VEC:
+        return [_neg(x) for x in a]
+    return -a
+
+def _scaled(op):
+    "Vector * or / scalar: scale each element, recursively"
+    def fn(a, b):
+        if type(a) in _VEC:
+            if type(b) in _VEC:
+                if op is operator.mul:
+                    return _matmul(a, b)
+                return op(a, b)
+            return [fn(x, b) for x in a]
+        if type(b) in _VEC and op is operator.mul:
+            return [fn(a, y) for y in b]
+        return op(a, b)
+    return fn
+
+# operator tables for the binary expression rules
+_EQ_OPS = {"==": operator.eq, "!=": operator.ne}
+_CMP_OPS = {"<": operator.lt, "<=": operator.le, ">=": operator.ge, ">": operator.gt}
+_ADD_OPS = {"+": _elementwise(operator.add), "-": _elementwise(operator.sub)}
+_MUL_OPS = {"*": _scaled(operator.mul), "/": _scaled(operator.truediv), "%": operator.mod}
+
+
 def _skip1(fn):
     fn.skip1 = True
     return fn
@@ -50,6 +125,9 @@ class _CommonRules:
         for nn in n:
             self.eval(nn)
 
+    def _e_const(self, n:Node) -> Any:
+        return n.value
+
 class _StaticRules(_CommonRules):
     def _e_Input(self, n):
         "top level"
@@ -217,16 +295,14 @@ class _StaticRules(_CommonRules):
     def _e_parameter_list(self, n):
         a = []
         k = {}
-        off = 0
-        while len(n) > off:
-            v = self.eval(n[off])
+        for nn in n[::2]:
+            v = self.eval(nn)
             if len(v) == 1:
                 a.append(v[0])
             elif v[0] in k:
-                raise ValueError("already set", n[off])
+                raise ValueError("already set", nn)
             else:
                 k[v[0]] = v[1]
-            off += 2
         return a, k
 
     def _e_parameter(self, n):
@@ -277,53 +353,49 @@ class _DynRules(_CommonRules):
     _e_special_call = _e_mod_call
 
     def _e_arguments(self, n):
-        arity(n, 1, 2)
+        if __debug__:
+            arity(n, 1, 2)
         return self.eval(n[0])
 
     def _e_argument_list(self, n):
         a = []
         k = {}
-        off = 0
-        while len(n) > off:
-            v = self.eval(n[off])
+        for nn in n[::2]:
+            v = self.eval(nn)
             if len(v) == 1:
                 a.append(v[0])
             elif v[0] in k:
-                raise ValueError("already set", n[off])
-            elif v[0].startswith("$"):
+                raise ValueError("already set", nn)
+            elif v[0][0] == "$":
                 self[v[0]] = v[1]
             else:
                 k[v[0]] = v[1]
-            off += 2
         return a, k
 
     def _e_argument(self, n):
         if len(n) == 1:
             return (self.eval(n[0]),)
         else:
-            arity(n, 3)
+            if __debug__:
+                arity(n, 3)
             return (
                 n[0].value,
                 self.eval(n[2]),
             )
 
-    def _e_pr_vec_empty(self, n):
+    def _e_pr_vec_empty(self, n:Node) -> Any:
         return ()
 
-    def _e_pr_vec_elems(self, n):
+    def _e_pr_vec_elems(self, n:Node) -> Any:
         return self.eval(n[1])
 
-    def _e_vector_elements(self, n):
-        res = []
-        off = 0
-        while off < len(n):
-            res.append(self.eval(n[off]))
-            off += 2
-        return res
+    def _e_vector_elements(self, n:Node) -> Any:
+        return [self.eval(nn) for nn in n[::2]]
 
-    def _e_expr_fn(self, n):
+    def _e_expr_fn(self, n:Node) -> Any:
         # build a function object
-        arity(n,4,5)
+        if __debug__:
+            arity(n,4,5)
         if len(n) == 5:
             params = self.eval(n[2])
         else:
@@ -333,241 +405,207 @@ class _DynRules(_CommonRules):
 
 
     @_skip1
-    def _e_expr_case(self, n):
+    def _e_expr_case(self, n:Node) -> Any:
         res = self.eval(n[0])
         if len(n) == 1:
             return res
-        arity(n, 5)
+        if __debug__:
+            arity(n, 5)
         if res:
             return self.eval(n[2])
         else:
             return self.eval(n[4])
 
     @_skip1
-    def _e_logic_or(self, n):
+    def _e_logic_or(self, n:Node) -> Any:
         res = self.eval(n[0])
-        off = 1
-        while len(n) > off:
+        for opn, arg in zip(n[1::2], n[2::2]):
             if res:
                 return res
-            if n[off].value == "||":
-                res = self.eval(n[off + 1])
-            else:
-                raise ValueError("Unknown op", n[off])
-            off += 2
+            if opn.value != "||":
+                raise ValueError("Unknown op", opn)
+            res = self.eval(arg)
         return res
 
     @_skip1
-    def _e_logic_and(self, n):
+    def _e_logic_and(self, n:Node) -> Any:
         res = self.eval(n[0])
-        off = 1
-        while len(n) > off:
+        for opn, arg in zip(n[1::2], n[2::2]):
             if not res:
                 return res
-            if n[off].value == "&&":
-                res = self.eval(n[off + 1])
-            else:
-                raise ValueError("Unknown op", n[off])
-            off += 2
+            if opn.value != "&&":
+                raise ValueError("Unknown op", opn)
+            res = self.eval(arg)
         return res
 
     @_skip1
-    def _e_equality(self, n):
+    def _e_equality(self, n:Node) -> Any:
         res = self.eval(n[0])
         if len(n) == 1:
             return res
-        off = 1
-        while len(n) > off:
-            res2 = self.eval(n[off + 1])
-            if n[off].value == "==":
-                if res != res2:
-                    return False
-            elif n[off].value == "!=":
-                if res == res2:
-                    return False
-            else:
-                raise ValueError("Unknown op", n[off])
-            off += 2
+        for opn, arg in zip(n[1::2], n[2::2]):
+            try:
+                op = _EQ_OPS[opn.value]
+            except KeyError:
+                raise ValueError("Unknown op", opn) from None
+            res2 = self.eval(arg)
+            if not op(res, res2):
+                return False
             res = res2
         return True
 
     @_skip1
-    def _e_comparison(self, n):
+    def _e_comparison(self, n:Node) -> Any:
         res = self.eval(n[0])
         if len(n) == 1:
             return res
-        off = 1
-        while len(n) > off:
-            res2 = self.eval(n[off + 1])
-            if n[off].value == "<":
-                if res >= res2:
-                    return False
-            elif n[off].value == "<=":
-                if res > res2:
-                    return False
-            elif n[off].value == ">=":
-                if res < res2:
-                    return False
-            elif n[off].value == ">":
-                if res <= res2:
-                    return False
-            else:
-                raise ValueError("Unknown op", n[off])
-            off += 2
+        for opn, arg in zip(n[1::2], n[2::2]):
+            try:
+                op = _CMP_OPS[opn.value]
+            except KeyError:
+                raise ValueError("Unknown op", opn) from None
+            res2 = self.eval(arg)
+            if not op(res, res2):
+                return False
             res = res2
         return True
 
     @_skip1
-    def _e_addition(self, n):
+    def _e_addition(self, n:Node) -> Any:
         res = self.eval(n[0])
-        if len(n) == 1:
-            return res
-        off = 1
-        while len(n) > off:
-            res2 = self.eval(n[off + 1])
-            if n[off].value == "+":
-                res += res2
-            elif n[off].value == "-":
-                res -= res2
-            else:
-                raise ValueError("Unknown op", n[off])
-            off += 2
+        for opn, arg in zip(n[1::2], n[2::2]):
+            try:
+                op = _ADD_OPS[opn.value]
+            except KeyError:
+                raise ValueError("Unknown op", opn) from None
+            res = op(res, self.eval(arg))
         return res
 
     @_skip1
-    def _e_multiplication(self, n):
+    def _e_multiplication(self, n:Node) -> Any:
         res = self.eval(n[0])
-        if len(n) == 1:
-            return res
-        off = 1
-        while len(n) > off:
-            res2 = self.eval(n[off + 1])
-            if n[off].value == "*":
-                res *= res2
-            elif n[off].value == "/":
-                res /= res2
-            elif n[off].value == "%":
-                res %= res2
-            else:
-                raise ValueError("Unknown op", n[off])
-            off += 2
+        for opn, arg in zip(n[1::2], n[2::2]):
+            try:
+                op = _MUL_OPS[opn.value]
+            except KeyError:
+                raise ValueError("Unknown op", opn) from None
+            res = op(res, self.eval(arg))
         return res
 
     @_skip1
-    def _e_unary(self, n):
-        arity(n, 1, 2)
+    def _e_unary(self, n:Node) -> Any:
+        if __debug__:
+            arity(n, 1, 2)
         res = self.eval(n[-1])
         if len(n) == 2:
-            if n[0].value == "+":
-                pass
-            elif n[0].value == "-":
-                res = -res
-            elif n[0].value == "!":
+            op = n[0].value
+            if op == "-":
+                res = _neg(res)
+            elif op == "!":
                 res = not res
-            else:
+            elif op != "+":
                 raise ValueError("Unknown op", n[0])
         return res
 
     @_skip1
-    def _e_exponent(self, n):
+    def _e_exponent(self, n:Node) -> Any:
         res = self.eval(n[0])
         if len(n) == 1:
             return res
-        arity(n, 3)
+        if __debug__:
+            arity(n, 3)
         exp = self.eval(n[2])
         if n[1].value == "^":
-            return math.pow(res, exp)
+            return _pow(res, exp)
         else:
             raise ValueError("Unknown op", n[1])
 
-    def _e_call(self, n):
+    @_skip1
+    def _e_call(self, n:Node) -> Any:
         # Special case: call a named function
         off = 1
-        if n[0][0].rule_name == "pr_Sym" and len(n) > 1 and n[1][0].rule_name == "add_args":
-            args = n[1][0]
+        prim = n[0][0]
+        if prim.rule_name == "pr_Sym" and len(n) > 1 and (args := n[1][0]).rule_name == "add_args":
             if len(args) == 2:
                 a, k = (),{}
             else:
-                a, k = self.eval(n[1])
-            res = self.func(n[0][0].value, *a, **k)
+                a, k = self.eval(args[1])
+            res = self.func(prim.value, *a, **k)
             off += 1
         else:
             res = self.eval(n[0])
 
-        while off < len(n):
-            app = self.eval(n[off])
-            res = app(res)
-            off += 1
+        # Apply indices and calls directly, instead of building a
+        # closure for each of them
+        for addon in n[off:]:
+            app = addon[0]
+            rule = app.rule_name
+            if rule == "add_index":
+                res = res[self.eval(app[1])]
+            elif rule == "add_args":
+                if len(app) == 2:
+                    a, k = (),{}
+                else:
+                    a, k = self.eval(app[1])
+                res = self.call(res, a, k)
+            else:
+                res = self.eval(addon)(res)
         return res
 
-    def _e_pr_Num(self, n):
-        val = n.value
-        try:
-            return int(val)
-        except ValueError:
-            return float(val)
+    def _e_pr_Num(self, n:Node) -> Any:
+        return _num_literal(n.value)
 
-    def _e_pr_Sym(self, n):
+    def _e_pr_Sym(self, n:Node) -> Any:
         return self.var(n.value)
 
     @_skip1
-    def _e_pr_paren(self, n):
+    def _e_pr_paren(self, n:Node) -> Any:
         return self.eval(n[1])
 
-    def _e_pr_Str(self, n):
-        return simple_eval(n.value)
+    def _e_pr_Str(self, n:Node) -> Any:
+        return _str_literal(n.value)
 
-    def _e_lce_for(self, n):
+    def _e_lce_for(self, n:Node) -> Any:
         raise ValueError("'for' in list comprehension is not implemented")
 
-    def _e_lce_for3(self, n):
+    def _e_lce_for3(self, n:Node) -> Any:
         raise ValueError("'for' in list comprehension is not implemented")
 
-    def _e_lce_let(self, n):
+    def _e_lce_let(self, n:Node) -> Any:
         raise ValueError("'let' in list comprehension is not implemented")
 
-    def _e_lce_if(self, n):
+    def _e_lce_if(self, n:Node) -> Any:
         raise ValueError("'if' in list comprehension is not implemented")
 
-    def _e_pr_for2(self, n):
+    def _e_pr_for2(self, n:Node) -> Any:
         return ForStep(n[1], n[3], 1)
 
-    def _e_pr_for3(self, n):
-        return ForStep(n[1], n[3], n[5])
+    def _e_pr_for3(self, n:Node) -> Any:
+        # [start:step:end]
+        return ForStep(n[1], n[5], n[3])
 
-    def _e_add_args(self, n):
+    def _e_add_args(self, n:Node) -> Any:
         if len(n) == 2:
-            return lambda x: x()
-        arity(n, 3)
-        a, k = self.eval(n[1])
-        return a,k
-
-    def _e_add_index(self, n):
-        if len(n) == 2:
-            return lambda x: x()
-        arity(n, 3, 999)
-
-        i = 1
-        idx = []
-        while i < len(n):
-            a = self.eval(n[1])
-            i += 2
-            idx.append(a)
-
-        def ind(idx, x):
-            for i in idx:
-                x = x[i]
-            return x
-
-        return partial(ind, idx)
+            a, k = (),{}
+        else:
+            if __debug__:
+                arity(n, 3)
+            a, k = self.eval(n[1])
+        return lambda x: self.call(x, a, k)
+
+    def _e_add_index(self, n:Node) -> Any:
+        # '[' expr ']'; chained indices are separate addons
+        if __debug__:
+            arity(n, 3)
+        return itemgetter(self.eval(n[1]))
 
-    def _e_pr_true(self, n):
+    def _e_pr_true(self, n:Node) -> Any:
         return True
 
-    def _e_pr_false(self, n):
+    def _e_pr_false(self, n:Node) -> Any:
         return False
 
-    def _e_pr_undef(self, n):
+    def _e_pr_undef(self, n:Node) -> Any:
         return None
 
     _e_expr = _descend
@@ -575,6 +613,158 @@ class _DynRules(_CommonRules):
     _e_vector_element = _descend
     _e_addon = _descend
 
+def _dispatch(cls: type) -> None:
+    """
+    Collect the ``_e_*`` methods of a rule class into a table, so that
+    the evaluator doesn't need to build method names and probe for
+    attributes on every node.
+    """
+    cls._rules = rules = {}
+    for k in dir(cls):
+        if k.startswith("_e_"):
+            rules[k[3:]] = getattr(cls, k)
+    cls._skip_rules = frozenset(k for k, fn in rules.items() if hasattr(fn, "skip1"))
+
+_dispatch(_StaticRules)
+_dispatch(_DynRules)
+
+
+# Pass-through expression rules. Nothing looks at these wrappers'
+# rule names, so they can be dropped from the tree. Parentheses are
+# removed too.
+_FLATTEN = frozenset((
+    "expr", "expr_case", "logic_or", "logic_and", "equality", "comparison",
+    "addition", "multiplication", "unary", "exponent", "vector_element",
+))
+
+def flatten(tree: Node) -> Node:
+    """
+    Remove single-child pass-through nodes from a parse tree.
+
+    A plain ``1`` is wrapped in a dozen of these (expr, expr_case,
+    logic_or, …), which the evaluator would otherwise need to step
+    through whenever the expression is evaluated.
+
+    Token strings are interned, so that looking up names compares
+    pointers instead of characters.
+
+    The tree is modified in place. Flattening it again is a no-op.
+    """
+    todo = [tree]
+    while todo:
+        node = todo.pop()
+        for i, ch in enumerate(node):
+            if not isinstance(ch, NonTerminal):
+                if type(ch.value) is str:
+                    ch.value = sys.intern(ch.value)
+                continue
+            orig = ch
+            while True:
+                if ch.rule_name in _FLATTEN and len(ch) == 1 and isinstance(ch[0], NonTerminal):
+                    ch = ch[0]
+                elif ch.rule_name == "pr_paren":
+                    ch = ch[1]
+                else:
+                    break
+            if ch is not orig:
+                node[i] = ch
+            todo.append(ch)
+    return tree
+
+
+class _Const:
+    """
+    A constant-folded expression, replacing its subtree.
+    """
+    __slots__ = ("value",)
+    rule_name = "const"
+
+    def __init__(self, value):
+        self.value = value
+
+    def tree_str(self, indent=0):
+        return f"{'  ' * indent}const {self.value!r}"
+
+    def __repr__(self):
+        return f"<const {self.value!r}>"
+
+
+class _Folder:
+    "Stand-in evaluator: all operands are constants at this point."
+    @staticmethod
+    def eval(n):
+        return n.value
+
+_FOLD = frozenset(("addition", "multiplication", "unary", "exponent"))
+_LITERALS = frozenset(("pr_Num", "pr_true", "pr_false", "pr_undef"))
+
+def _as_const(n):
+    """
+    Return a constant node if @n is a literal, or a parenthesized
+    constant. Otherwise return None.
+    """
+    if type(n) is _Const:
+        return n
+    if n.rule_name != "call" or len(n) != 1:
+        return None
+    n = n[0][0]
+    if type(n) is _Const:
+        return n
+    if n.rule_name in _LITERALS:
+        return _Const(_DynRules._rules[n.rule_name](_Folder, n))
+    return None
+
+def constfold(tree: Node) -> Node:
+    """
+    Pre-compute arithmetic on literals, like ``2*3`` or ``-1``.
+
+    Subtrees that only contain scalar constants are replaced with a
+    "const" node that carries the result. Anything that fails, or
+    results in a vector, is left alone so that errors are reported
+    when the expression is actually evaluated.
+
+    This should run after `flatten`. The tree is modified in place.
+    """
+    nodes = []
+    todo = [tree]
+    while todo:
+        node = todo.pop()
+        nodes.append(node)
+        for ch in node:
+            if isinstance(ch, NonTerminal):
+                todo.append(ch)
+
+    # children before their parents
+    for node in reversed(nodes):
+        for i, ch in enumerate(node):
+            if isinstance(ch, NonTerminal) and ch.rule_name in _FOLD:
+                res = _fold(ch)
+                if res is not None:
+                    node[i] = res
+    return tree
+
+def _fold(n):
+    if n.rule_name == "unary":
+        ops = (len(n)-1,)
+    else:
+        ops = range(0, len(n), 2)
+    consts = []
+    for i in ops:
+        c = _as_const(n[i])
+        if c is None:
+            return None
+        consts.append((i, c))
+    for i, c in consts:
+        n[i] = c
+    try:
+        res = _DynRules._rules[n.rule_name](_Folder, n)
+    except Exception:
+        return None
+    if res is not None and type(res) not in (int, float, bool):
+        return None
+    return _Const(res)
+
+
 class XXX_EvalVar:
     """Holds the expression for a variable.
 
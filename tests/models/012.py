@@ -0,0 +1 @@
+work=None
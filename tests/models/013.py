@@ -0,0 +1,8 @@
+from __future__ import annotations
+
+def work():
+    boxes = [
+        Pos(x, y, z) * Box(1, 1, 1, align=(Align.MIN,) * 3)
+        for x, y, z in ((0, 0, 0), (1, 0, 0), (2, 1, 0), (3, 2, 1), (10, 0, 0), (10, 3, 0))
+    ]
+    return boxes[0] + boxes[1:]
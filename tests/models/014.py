@@ -0,0 +1,13 @@
+from __future__ import annotations
+
+def work():
+    def notch(d):
+        return Box(2, 2, 2, align=(Align.MIN,) * 3) - \
+               Pos(d, d, d) * Box(2, 2, 2, align=(Align.MIN,) * 3)
+
+    return (
+        notch(1)
+        + Pos(5, 0, 0) * notch(1)
+        + Pos(0, 5, 0) * notch(1.5)
+        + Pos(6, 6, 1) * Box(1, 1, 1, align=(Align.MIN,) * 3)
+    )
@@ -0,0 +1,7 @@
+from __future__ import annotations
+
+def work():
+    res = Box(1, 1, 3, align=(Align.MIN,) * 3)
+    for x, y, z in ((0, 4, 0), (8, 0, 0), (0, 0, 4), (4, 4, 0)):
+        res += Pos(x, y, z) * Box(1, 1, 1, align=(Align.MIN,) * 3)
+    return res
@@ -0,0 +1,8 @@
+from __future__ import annotations
+
+def work():
+    res = Box(2, 1, 3, align=(Align.MIN,) * 3)
+    res += Pos(0, 3, 0) * Box(4, 1, 3, align=(Align.MIN,) * 3)
+    for i in (1, 2, 3):
+        res += Pos(0, 3 * i + 3, 0) * Box(2 * i, 1, 3, align=(Align.MIN,) * 3)
+    return res
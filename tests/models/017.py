@@ -0,0 +1,14 @@
+from __future__ import annotations
+
+def work():
+    pos = [
+        (0, 0, 0), (3, 0, 0),
+        (0, 3, 0), (3, 3, 0),
+        (0, 6, 0), (1.5, 6, 0), (3, 6, 0),
+        (6, 6, 0),
+        (0, 9, 0), (0, 12, 0), (3, 9, 0), (3, 12, 0),
+        (6, 0, 0), (6, 0, 3), (9, 0, 0), (9, 0, 3),
+        (9, 9, 0),
+    ]
+    boxes = [Pos(*p) * Box(1, 1, 1, align=(Align.MIN,) * 3) for p in pos]
+    return boxes[0] + boxes[1:]
@@ -0,0 +1,16 @@
+from __future__ import annotations
+
+tolerance = 0.5
+
+def work():
+    bottom = (Align.CENTER, Align.CENTER, Align.MIN)
+    center = (Align.CENTER,) * 3
+    return (
+        Cylinder(1, 2, align=bottom)
+        + Pos(5, 0, 0) * Cylinder(1.5, 2, align=bottom)
+        + Pos(10, 0, 0) * Cylinder(1, 2, align=center)
+        + Pos(0, 10, 0) * Cylinder(1, 2, align=bottom)
+        + Pos(0, 5, 0) * Cone(1, 2, 3, align=bottom)
+        + Pos(5, 5, 0) * Cone(2, 1, 3, align=center)
+        + Pos(10, 5, 0) * Cylinder(1.5, 2, align=bottom)
+    )
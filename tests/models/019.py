@@ -0,0 +1,8 @@
+def result():
+    c = 2*3+1 - -2 + 2**3
+    m = a*10 + a + 2*3
+    s = str(1+2) + "x"
+    v = [1, 2*3, -4]
+    return c + m + len(s) + len("ab") + v[1] + v[2]
+
+a = 2
@@ -0,0 +1,3 @@
+def result():
+    # the number of exact results
+    return 11
@@ -0,0 +1,10 @@
+from __future__ import annotations
+
+def work():
+    return (
+        Box(1, 1, 1, align=(Align.MIN,) * 3)
+        + Pos(5, 0, 0) * Box(2, 2, 2, align=(Align.MIN,) * 3)
+        + Pos(0, 5, 0) * Box(2, 1, 1, align=(Align.MIN,) * 3)
+        + Pos(0, 7, 0) * Box(4, 1, 1, align=(Align.MIN,) * 3)
+        + Pos(0, 9, 0) * Box(1, 1, 1, align=(Align.MIN,) * 3)
+    )
@@ -0,0 +1,63 @@
+from __future__ import annotations
+
+from build123d import Part
+
+from buildscad import process
+
+
+def test_build_cache(tmp_path, monkeypatch):
+    cache = tmp_path / "cache"
+    monkeypatch.setenv("BUILDSCAD_CACHE", str(cache))
+    f = tmp_path / "a.scad"
+    f.write_text("a = 1;\ncube([a, 2, 3]);\n")
+
+    env = process(f, cache=True)
+    fn = env._build_file()
+    assert fn is not None
+    res = env.build()
+    assert abs(res.volume - 6) < 0.001
+    assert len(list(cache.iterdir())) == 1
+    # a hit, of the same type
+    env = process(f, cache=True)
+    assert env._build_file() == fn
+    res2 = env.build()
+    assert isinstance(res, Part) and isinstance(res2, Part)
+    assert abs(res2.volume - 6) < 0.001
+
+    # tracing doesn't change the key, but bypasses the cache
+    for x in cache.iterdir():
+        x.unlink()
+    env = process(f, cache=True)
+    with env.tracing():
+        assert env._build_file() == fn
+        env.build()
+    assert not any(cache.iterdir())
+
+    # overrides, including those applied after process(), miss
+    env = process(f, cache=True, a=2)
+    assert env._build_file() != fn
+    env = process(f, cache=True)
+    env.set_var("a", 3)
+    assert env._build_file() != fn
+    assert abs(env.build().volume - 18) < 0.001
+
+    # so do changed sources
+    f2 = tmp_path / "b.scad"
+    f2.write_text("a = 1;\ncube([a, 2, 4]);\n")
+    assert process(f2, cache=True)._build_file() != fn
+
+    # preloads can do anything, thus aren't cached
+    pre = tmp_path / "pre.py"
+    pre.write_text("b = 1\n")
+    assert process(f, preload=[pre], cache=True)._build_file() is None
+
+    # random numbers aren't cached, but a mention in a comment is harmless
+    n = len(list(cache.iterdir()))
+    f3 = tmp_path / "c.scad"
+    f3.write_text("cube(rands(1, 2, 1)[0]);\n")
+    process(f3, cache=True).build()
+    assert len(list(cache.iterdir())) == n
+    f4 = tmp_path / "d.scad"
+    f4.write_text("// rands() import()\ncube(1);\n")
+    process(f4, cache=True).build()
+    assert len(list(cache.iterdir())) == n + 1
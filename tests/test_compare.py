@@ -1,13 +1,16 @@
 from __future__ import annotations
 
 import os
-from functools import partial
 from pathlib import Path
 
+import pytest
+
 from buildscad import parse
 from buildscad._test import testcase as runner
 # can't be named "test*" or pytest tries to run it directly
 
+_MISSING = object()
+
 
 def _test(i):
     res = runner(i, may_skip=True)
@@ -23,18 +26,14 @@ def _test(i):
 
     if res.numeric:
         v = iter(res.models)
-        try:
-            vn = res.value
-        except AttributeError:
+        vn = getattr(res, "value", _MISSING)
+        if vn is _MISSING:
             vn,vname = next(v)
-            if callable(vn):
-                breakpoint()
-                vn=vn()
+            vn = vn() if callable(vn) else vn
         else:
             vname = "preset"
         for vv,vvn in v:
-            if callable(vv):
-                vv=vv()
+            vv = vv() if callable(vv) else vv
             assert abs(vn - vv) < res.tolerance, (vname,vn, vvn,vv)
         return
 
@@ -42,15 +41,14 @@ def _test(i):
     if res.no_add:
         msum = None
     else:
-        mods = iter(res.models)
-        msum = next(mods)[0]
-        for m,n in mods:
-            msum += m
+        # fuse them all in one go
+        msum, *mods = (m for m,n in res.models)
+        if mods:
+            msum = msum + mods
         msum = msum.volume
 
-    try:
-        vn = res.volume
-    except AttributeError:
+    vn = getattr(res, "volume", _MISSING)
+    if vn is _MISSING:
         vn,vname = v.pop()
     else:
         vname = "preset"
@@ -61,15 +59,17 @@ def _test(i):
         if msum is not None:
             assert abs(msum - vv) < res.tolerance, (msum, vvn,vv)
 
-_i = 0
-_missing = 0
-while True:
-    _i += 1
-    if not os.path.exists(f"tests/models/{_i :03d}.scad") and \
-       not os.path.exists(f"tests/models/{_i :03d}.py"):
-        _missing += 1
-        if _missing > 10:
-            break
-        continue
-    print("TEST", _i)
-    globals()[f"test_{_i :03d}"] = partial(_test, _i)
+def _models():
+    # one directory scan instead of probing for each number
+    res = set()
+    with os.scandir("tests/models") as it:
+        for e in it:
+            stem, _, ext = e.name.partition(".")
+            if ext in ("scad", "py") and stem.isdigit():
+                res.add(int(stem))
+    return sorted(res)
+
+# Independent of each other, thus can be distributed with pytest-xdist
+@pytest.mark.parametrize("i", _models(), ids="{:03d}".format)
+def test_model(i):
+    _test(i)